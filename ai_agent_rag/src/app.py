@@ -3,28 +3,54 @@ FastAPI application for paper Q&A.
 
 Endpoints:
 - POST /ask-paper: Ask a question about a LaTeX paper
+- POST /ask-paper-batch: Ask several questions with one retrieval pass
 - GET /ping: Health check
 """
 
+import asyncio
+
 from fastapi import FastAPI
-from .models import QueryRequest, QueryResponse
+from .models import QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse
 from .rag import KnowledgeBase
 from .mcp import build_prompt
-from .llm import call_llm
+from .llm import call_llm, close_client
+from .batching import RetrievalBatcher
 
 app = FastAPI(title="Paper Q&A Assistant", version="1.0.0")
 
+TOP_K = 5  # chunks retrieved per question, shared by both ask endpoints
+
 kb = None
+batcher = None
 
-@app.post("/ask-paper", response_model=QueryResponse)
-def ask_paper(query: QueryRequest) -> QueryResponse:
-    global kb
-    if kb is None:
-        kb = KnowledgeBase()
+@app.on_event("startup")
+async def load_knowledge_base():
+    # Build the index and run one throwaway query at boot, so the first request
+    # pays neither the index build nor the encoder's first-forward-pass costs
+    global kb, batcher
+    kb = await asyncio.to_thread(KnowledgeBase)
+    await asyncio.to_thread(kb.retrieve, "warmup", 1)
+    batcher = RetrievalBatcher(kb, top_k=TOP_K)
 
-    retrieved = kb.retrieve(query.query, top_k=5)
+@app.on_event("shutdown")
+async def close_llm_client():
+    await close_client()
+
+@app.post("/ask-paper", response_model=QueryResponse)
+async def ask_paper(query: QueryRequest) -> QueryResponse:
+    # Retrieval is CPU-bound -> batched with concurrent requests in a worker thread;
+    # the LLM call is awaited on the event loop
+    retrieved = await batcher.retrieve(query.query)
     prompt = build_prompt(query.query, retrieved)
-    return call_llm(prompt)
+    return await call_llm(prompt)
+
+@app.post("/ask-paper-batch", response_model=BatchQueryResponse)
+async def ask_paper_batch(batch: BatchQueryRequest) -> BatchQueryResponse:
+    retrieved = await asyncio.to_thread(kb.retrieve_batch, batch.queries, TOP_K)
+    responses = await asyncio.gather(
+        *(call_llm(build_prompt(q, r)) for q, r in zip(batch.queries, retrieved))
+    )
+    return BatchQueryResponse(results=list(responses))
 
 @app.get("/ping")
 def ping():
@@ -0,0 +1,57 @@
+"""
+Micro-batching for concurrent retrieval requests.
+
+- Collects queries that arrive within a short window (default 5 ms)
+- Runs one KnowledgeBase.retrieve_batch call per window in a worker thread
+- Resolves each caller with its own results
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+
+from .rag import KnowledgeBase
+
+class RetrievalBatcher:
+    def __init__(self, kb: KnowledgeBase, top_k: int = 5, window_s: float = 0.005, max_batch: int = 64):
+        self.kb = kb
+        self.top_k = top_k
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()  # keep running batches referenced
+
+    async def retrieve(self, query: str) -> List[Dict]:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((query, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+        return await fut
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window_s)
+        self._timer = None
+        self._flush()
+
+    def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        queries = [q for q, _ in batch]
+        try:
+            results = await asyncio.to_thread(self.kb.retrieve_batch, queries, self.top_k)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
@@ -0,0 +1,197 @@
+"""
+Sentence encoders used by the knowledge base.
+
+- OnnxEncoder: SentenceTransformer checkpoint exported to ONNX with optimum and
+  dynamic int8 quantized (cached on disk); ORT fuses the graph at session load
+- TorchEncoder: the same checkpoint's HF model in PyTorch (fp32/fp16/bf16)
+- Both tokenize all inputs in one call, batch by token length,
+  mean-pool in float32 and L2-normalize
+"""
+
+import os
+import logging
+import platform
+from typing import List
+
+import numpy as np
+import torch
+import onnxruntime as ort
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from sentence_transformers import SentenceTransformer
+from transformers import AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "onnx_models")
+# Part of the file name (and the index cache key) so exports made with another
+# quantization config are not reused
+QUANTIZED_SUFFIX = "int8_rr"
+QUANTIZED_FILE = f"model_{QUANTIZED_SUFFIX}.onnx"
+MAX_SEQ_LENGTH = 256
+
+
+def _export_quantized(model_name: str, export_dir: str) -> None:
+    """Export model_name to ONNX and quantize weights to int8.
+
+    The fp32 export is quantized directly: quantizing an ORTOptimizer-fused graph
+    fails on current optimum/onnxruntime because shape inference cannot type the
+    fused contrib ops. The session's ORT_ENABLE_ALL applies those fusions at load.
+    """
+    logger.info(f"[ONNX] Exporting {model_name} to {export_dir}")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(export_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+
+    # model.onnx -> QUANTIZED_FILE (dynamic int8). On x86 the export lives in a shared
+    # cache, so use U8S8 with reduced range: without VNNI (AVX2, plain AVX-512) full-range
+    # U8S8 can saturate, while reduced range is accurate on every x86 host
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    else:
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False, reduce_range=True)
+    quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model.onnx")
+    quantizer.quantize(save_dir=export_dir, quantization_config=qconfig, file_suffix=QUANTIZED_SUFFIX)
+
+
+def _length_batches(tokenizer, texts: List[str], batch_size: int, max_seq_length: int, return_tensors: str):
+    """Tokenize texts in one call and yield (indices, padded batch) in token-length order."""
+    if isinstance(texts, str):
+        texts = [texts]
+    if len(texts) == 0:  # tokenizers reject an empty batch
+        return
+    enc = tokenizer(list(texts), padding=False, truncation=True, max_length=max_seq_length)
+    order = np.argsort([len(ids) for ids in enc["input_ids"]], kind="stable")
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        yield idx, tokenizer.pad({k: [enc[k][i] for i in idx] for k in enc.keys()}, return_tensors=return_tensors)
+
+
+def _gather(pooled: List[np.ndarray], order: List[np.ndarray], dim: int, normalize: bool) -> np.ndarray:
+    """Scatter length-sorted batches back to input order and optionally L2-normalize."""
+    embs = np.empty((sum(len(idx) for idx in order), dim), dtype=np.float32)
+    for batch, idx in zip(pooled, order):
+        embs[idx] = batch
+    if normalize:
+        embs /= np.clip(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12, None)
+    return embs
+
+
+def _cpu_has_bf16() -> bool:
+    """True when the CPU runs bf16 matmuls natively (AVX512-BF16 or AMX).
+
+    oneDNN's own bf16 check also passes on plain AVX-512 CPUs (Skylake, Cascade Lake),
+    where bf16 is emulated and slower than fp32.
+    """
+    cpu = getattr(torch._C, "_cpu", None)
+    for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        try:
+            if getattr(cpu, check)():
+                return True
+        except (AttributeError, RuntimeError):
+            pass
+    return False
+
+
+def _resolve_dtype(name: str, device: str) -> torch.dtype:
+    """Map a dtype name to torch; "auto" picks fp16 on GPU, bf16 on CPUs with native bf16, else fp32."""
+    if name != "auto":
+        return getattr(torch, name)
+    if device.startswith("cuda"):
+        return torch.float16
+    return torch.bfloat16 if _cpu_has_bf16() else torch.float32
+
+
+class OnnxEncoder:
+    """Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime."""
+
+    def __init__(
+        self,
+        model_name: str,
+        cache_dir: str = ONNX_CACHE_DIR,
+        max_seq_length: int = MAX_SEQ_LENGTH,
+        num_threads: int = None,
+    ):
+        export_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        model_path = os.path.join(export_dir, QUANTIZED_FILE)
+        self.dtype = QUANTIZED_SUFFIX
+        if not os.path.exists(model_path):
+            _export_quantized(model_name, export_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_seq_length = max_seq_length
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self.dim = next(o.shape[-1] for o in self.session.get_outputs() if o.name == "last_hidden_state")
+        logger.info(f"[ONNX] Loaded {model_path}")
+
+    def encode(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+    ) -> np.ndarray:
+        """Encode texts into a (len(texts), dim) float32 array, in input order.
+
+        show_progress_bar and convert_to_numpy are accepted for call-site
+        compatibility with SentenceTransformer; output is always NumPy.
+        """
+        pooled, order = [], []
+        for idx, batch in _length_batches(self.tokenizer, texts, batch_size, self.max_seq_length, "np"):
+            feeds = {k: v.astype(np.int64, copy=False) for k, v in batch.items() if k in self._input_names}
+            hidden = self.session.run(["last_hidden_state"], feeds)[0]
+
+            # Mean-pool over real tokens only
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            pooled.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+            order.append(idx)
+        return _gather(pooled, order, self.dim, normalize_embeddings)
+
+
+class TorchEncoder:
+    """SentenceTransformer (Transformer + mean pooling) checkpoint run through its HF model directly.
+
+    Bypasses SentenceTransformer.encode, which re-invokes the tokenizer per mini-batch.
+    """
+
+    def __init__(self, model_name: str, dtype: str = "auto"):
+        st = SentenceTransformer(model_name)
+        self.tokenizer = st.tokenizer
+        self.max_seq_length = st.max_seq_length
+        self.device = st.device
+        self.dtype = _resolve_dtype(dtype, str(self.device))
+        self.model = st[0].auto_model.to(self.device, self.dtype).eval()
+        self.dim = self.model.config.hidden_size
+        logger.info(f"[Torch] Loaded {model_name} on {self.device} in {self.dtype}")
+
+    @torch.inference_mode()
+    def encode(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+    ) -> np.ndarray:
+        """Encode texts into a (len(texts), dim) float32 array, in input order.
+
+        show_progress_bar and convert_to_numpy are accepted for call-site
+        compatibility with SentenceTransformer; output is always NumPy.
+        """
+        pooled, order = [], []
+        for idx, batch in _length_batches(self.tokenizer, texts, batch_size, self.max_seq_length, "pt"):
+            batch = batch.to(self.device)
+            # Upcast the last hidden state before pooling so fp16/bf16 runs
+            # accumulate the mean in float32
+            hidden = self.model(**batch).last_hidden_state.float()
+
+            mask = batch["attention_mask"].unsqueeze(-1).float()
+            pooled.append(((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)).cpu().numpy())
+            order.append(idx)
+        return _gather(pooled, order, self.dim, normalize_embeddings)
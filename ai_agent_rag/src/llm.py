@@ -6,24 +6,65 @@ Handles interaction with Ollama LLM backend.
 - Handles malformed responses gracefully
 """
 
-import os, json, re
-from typing import Any, Dict
+import os
+import httpx
+import orjson
+from typing import Any, Dict, Optional
 from pydantic import ValidationError
-from openai import OpenAI, APIConnectionError, APIStatusError, RateLimitError
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError, APIStatusError, RateLimitError
 from .models import QueryResponse
 
-def get_client() -> OpenAI:
-    base_url = os.getenv("OPENAI_BASE_URL")
-    api_key = os.getenv("OPENAI_API_KEY", "EMPTY")
-    return OpenAI(base_url=base_url, api_key=api_key) if base_url else OpenAI(api_key=api_key)
+_CLIENT: Optional[AsyncOpenAI] = None
+
+def get_client() -> AsyncOpenAI:
+    # One shared client so keep-alive connections to the LLM backend are reused across requests
+    global _CLIENT
+    if _CLIENT is None:
+        base_url = os.getenv("OPENAI_BASE_URL")
+        api_key = os.getenv("OPENAI_API_KEY", "EMPTY")
+        # The SDK's default client keeps its timeouts and redirect handling; only the pool is widened
+        http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(max_keepalive_connections=32, max_connections=64))
+        _CLIENT = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=http_client) if base_url \
+            else AsyncOpenAI(api_key=api_key, http_client=http_client)
+    return _CLIENT
+
+async def close_client() -> None:
+    # Release pooled connections on shutdown
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.close()
+        _CLIENT = None
 
 def _strip_to_json(text: str) -> str:
-    if "```" in text:
-        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.DOTALL)
-    start, end = text.find("{"), text.rfind("}")
-    return text[start:end+1] if start != -1 and end > start else text
+    """Return the first balanced {...} object in text (e.g. inside ```json fences) in one scan."""
+    start = text.find("{")
+    if start == -1:
+        return text
+
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+
+    # Unbalanced: fall back to the widest candidate and let the parser report it
+    end = text.rfind("}")
+    return text[start:end + 1] if end > start else text
 
-def call_llm(prompt: str, model: str = None) -> QueryResponse:
+async def call_llm(prompt: str, model: str = None) -> QueryResponse:
     client = get_client()
     model = model or os.getenv("OPENAI_MODEL", "llama3.1")
 
@@ -34,17 +75,17 @@ def call_llm(prompt: str, model: str = None) -> QueryResponse:
     ]
 
     try:
-        resp = client.chat.completions.create(
+        resp = await client.chat.completions.create(
             model=model, messages=messages,
             response_format={"type": "json_object"},
             temperature=0, timeout=120
         )
         text = resp.choices[0].message.content.strip()
         try:
-            data = json.loads(text)
-        except json.JSONDecodeError:
+            data = orjson.loads(text)
+        except orjson.JSONDecodeError:
             text = _strip_to_json(text)
-            data = json.loads(text)
+            data = orjson.loads(text)
         return QueryResponse(**data)
 
     except (APIConnectionError, RateLimitError, APIStatusError) as e:
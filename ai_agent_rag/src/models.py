@@ -4,6 +4,7 @@ Defines the core Pydantic schemas used by the API.
 - QueryRequest: input model for user queries/questions.
 - QueryResponse: output model enforcing structured JSON with
   'answer' and 'references'.
+- BatchQueryRequest / BatchQueryResponse: several questions answered in one call.
 """
 
 from pydantic import BaseModel, Field
@@ -15,3 +16,9 @@ class QueryRequest(BaseModel):
 class QueryResponse(BaseModel):
     answer: str
     references: List[str]
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., description="Questions about the scientific papers, answered together")
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
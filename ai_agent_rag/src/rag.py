@@ -1,123 +1,374 @@
 import os
 import re
+import mmap
 import glob
+import pickle
+import hashlib
 import logging
-from dataclasses import dataclass
+import bisect
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import List, Dict, Tuple
 
+# Thread pools must be sized before torch / FAISS / BLAS initialize them;
+# NUM_THREADS also sizes the ONNX Runtime session (see _load_encoder)
+NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", os.cpu_count() or 1))
+FAISS_SEARCH_THREADS = int(os.getenv("FAISS_SEARCH_THREADS", 1))  # requests already run concurrently
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NUM_THREADS))
+
+import torch
+torch.set_num_threads(NUM_THREADS)
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:  # already set, or parallel work has started
+    pass
+
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from .encoder import OnnxEncoder, TorchEncoder
 
 logger = logging.getLogger(__name__)
 
 CHUNK_SIZE = 2500
 CHUNK_OVERLAP = 200
+QUERY_CACHE_SIZE = 1024
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "onnx")  # "onnx" (int8 ONNX Runtime) or "torch"
+EMBED_DTYPE = os.getenv("EMBED_DTYPE", "auto")  # torch backend: "auto", "float32", "float16" or "bfloat16"
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", "index_cache")
+INDEX_CACHE_VERSION = 5  # bump when cleaning, chunking or the pickled chunk layout changes
+
+# Commands with or without a braced argument (optionally starred), or a comment.
+# Like LaTeX, a comment also eats its newline, and a line holding only commands and
+# comments goes with its newline, so neither leaves a blank line that reads as a
+# paragraph break. Bytes pattern so it scans the memory-mapped file directly.
+# Keep it linear: a comment runs to end of line, so the line-only branch allows at
+# most one, last; repeating it inside the loop backtracks exponentially on "%%%%...".
+_LATEX_CMD = rb"\\[a-zA-Z]+(?:\{[^}]*\}|\*)?"
+_LATEX_COMMENT = rb"(?<!\\)%[^\n]*"  # \% is a literal percent sign
+_LATEX_NOISE = re.compile(
+    rb"(?m)^[ \t]*(?:(?:" + _LATEX_CMD + rb"[ \t]*)+(?:" + _LATEX_COMMENT + rb")?|"
+    + _LATEX_COMMENT + rb")\n|" + _LATEX_CMD + rb"|" + _LATEX_COMMENT + rb"\n?"
+)
+_WHITESPACE = re.compile(r"\s+")
+_PARAGRAPH_BREAK = re.compile(r"\n[^\S\n]*\n\s*")  # a blank line, plus any whitespace around it
+# Chunk boundaries: whitespace after sentence-ending punctuation, or a paragraph break
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
 
+@contextmanager
+def _mapped(fp: str):
+    """Yield a read-only mmap of fp (b"" for empty files, which cannot be mapped)."""
+    with open(fp, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
 
-@dataclass
-class PaperChunk:
-    text: str
-    reference: str
 
+def _read_tex(fp: str) -> str:
+    """Read a .tex document and return its cleaned content."""
+    with _mapped(fp) as raw:
+        # Clean LaTeX commands and comments in one scan over the mapped bytes;
+        # only the remaining text gets decoded
+        cleaned = _LATEX_NOISE.sub(b"", raw).decode("utf-8")
 
-def _read_docs(path_glob: str) -> List[Tuple[str, str]]:
-    """Read all .tex documents and return (title, cleaned_content)."""
-    docs = []
-    files = sorted(glob.glob(path_glob))
+    # Collapse whitespace on str so Unicode spaces count too; keep paragraph
+    # breaks as "\n\n" so chunking can cut on them
+    paragraphs = (_WHITESPACE.sub(" ", p).strip() for p in _PARAGRAPH_BREAK.split(cleaned))
+    return "\n\n".join(p for p in paragraphs if p)
 
-    if not files:
-        logger.warning(f"[RAG] No files found at {path_glob}. Check Docker COPY paths.")
-    else:
-        logger.info(f"[RAG] Found {len(files)} documents: {files}")
 
-    for fp in files:
-        title = os.path.splitext(os.path.basename(fp))[0]
-        with open(fp, "r", encoding="utf-8") as f:
-            raw = f.read()
+def _file_stat(fp: str) -> Tuple[int, int]:
+    st = os.stat(fp)
+    return st.st_mtime_ns, st.st_size
 
-            # Clean LaTeX commands and comments
-            cleaned = re.sub(r"\\[a-zA-Z]+\{[^}]*\}", "", raw)   # remove commands with braces
-            cleaned = re.sub(r"\\[a-zA-Z]+\*?", "", cleaned)    # remove commands without braces
-            cleaned = re.sub(r"%.*", "", cleaned)               # remove comments
-            cleaned = re.sub(r"\s+", " ", cleaned).strip()      # collapse whitespace
 
-        docs.append((title, cleaned))
-    return docs
+def _file_hash(fp: str) -> str:
+    with _mapped(fp) as raw:
+        return hashlib.sha256(raw).hexdigest()
 
 
-def _chunk(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
-    """Split text into overlapping chunks."""
+def _chunk(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    """Split text into overlapping chunks of at most size chars, returned as (start, end) offsets.
+
+    Chunks end at the last sentence/paragraph boundary that fits, falling back to a
+    hard cut when a single sentence is longer than size. The next chunk starts at the
+    first sentence inside the trailing overlap window, else carries the last overlap chars.
+    """
     if overlap >= size:
         raise ValueError("Overlap must be smaller than chunk size")
 
-    chunks = []
-    start = 0
-    n = len(text)
+    seps = list(_SENTENCE_BREAK.finditer(text))
+    ends = [m.start() for m in seps]     # where a sentence stops
+    starts = [m.end() for m in seps]     # where the next one begins
 
+    chunks = []
+    start, n = 0, len(text)
     while start < n:
-        end = min(n, start + size)
-        chunks.append(text[start:end])
-        start = start + size - overlap
+        limit = start + size
+        if limit >= n:
+            chunks.append((start, n))
+            break
+
+        # Last boundary in (start + overlap, limit]; past the overlap so every chunk makes progress
+        i = bisect.bisect_right(ends, limit) - 1
+        end = ends[i] if i >= 0 and ends[i] > start + overlap else limit
+        chunks.append((start, end))
+
+        j = bisect.bisect_left(starts, end - overlap)
+        start = starts[j] if j < len(starts) and starts[j] < end else end - overlap
 
     return chunks
 
 
+def _load_encoder(model_name: str):
+    """Load the sentence encoder selected by EMBED_BACKEND."""
+    if EMBED_BACKEND == "onnx":
+        return OnnxEncoder(model_name, num_threads=NUM_THREADS)
+    if EMBED_BACKEND == "torch":
+        return TorchEncoder(model_name, dtype=EMBED_DTYPE)
+    raise ValueError(f"Unknown EMBED_BACKEND: {EMBED_BACKEND!r}")
+
+
 class KnowledgeBase:
     def __init__(
         self,
         docs_glob: str = "input/*.tex",  # ✅ Correct relative path inside container
         model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        cache_dir: str = INDEX_CACHE_DIR,
     ):
-        self.model = SentenceTransformer(model_name)
-        self.entries: List[PaperChunk] = []
+        self.model = _load_encoder(model_name)
+        self.cache_dir = cache_dir
+
+        # Chunks as struct-of-arrays: chunk i is contents[doc[i]][start[i]:end[i]], cited as refs[i].
+        # Overlapping chunks share their paper's cleaned string instead of copying it.
+        self.contents: List[str] = []
+        self.chunk_doc = np.empty(0, dtype=np.int32)
+        self.chunk_start = np.empty(0, dtype=np.int64)
+        self.chunk_end = np.empty(0, dtype=np.int64)
+        self.refs: List[str] = []
 
+        # LRU of normalized (dim,) query embeddings; retrieval runs in worker threads
+        self._qcache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._qcache_lock = threading.Lock()
+
+        files = sorted(glob.glob(docs_glob))
         print("[RAG] Reading documents from:", docs_glob)
-        print("[RAG] Files detected:", glob.glob(docs_glob))
+        print("[RAG] Files detected:", files)
+        if not files:
+            logger.warning(f"[RAG] No files found at {docs_glob}. Check Docker COPY paths.")
+
+        # Embeddings depend on the encoder and chunking, so both are part of the cache key.
+        # The dtype is the one the encoder resolved ("auto" differs across GPU / CPU hosts
+        # sharing the mounted cache), or the ONNX quantization scheme
+        cache_key = {
+            "version": INDEX_CACHE_VERSION,
+            "model": model_name,
+            "backend": EMBED_BACKEND,
+            "dtype": str(self.model.dtype),
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+        }
+        manifest, cached_embs = self._load_cache(cache_key)
+
+        if manifest is not None and list(manifest["files"]) == files and all(
+            manifest["files"][fp]["stat"] == _file_stat(fp) for fp in files
+        ):
+            self._set_chunks(manifest["chunks"])
+            self.index = faiss.read_index(self._cache_path("kb.faiss"), faiss.IO_FLAG_MMAP)
+            self._embs = cached_embs
+            print("[RAG] Loaded cached FAISS index with", self.index.ntotal, "chunks.")
+        else:
+            self._build(files, manifest, cached_embs)
+            self._save_cache(cache_key)
+
+    def _build(self, files: List[str], manifest, cached_embs) -> None:
+        """Chunk and encode changed files, reuse cached rows for unchanged ones."""
+        cached_files = manifest["files"] if manifest is not None else {}
+        cached_chunks = manifest["chunks"] if manifest is not None else None
+        self._file_meta = {}
+        contents, doc, starts, ends, refs = [], [], [], [], []
+        reused = []  # (new_start, old_start, count)
+        stale = []   # (new_start, count) of rows that need encoding
 
         # Read and chunk papers
-        for title, content in _read_docs(docs_glob):
-            chunks = _chunk(content)
-            for i, ch in enumerate(chunks):
-                ref = f"{title}, chunk {i + 1}"
-                self.entries.append(PaperChunk(text=ch, reference=ref))
+        for fp in files:
+            digest = _file_hash(fp)
+            row = len(refs)
+            prev = cached_files.get(fp)
+            if prev is not None and prev["hash"] == digest:
+                old_start, old_end = prev["rows"]
+                contents.append(cached_chunks["contents"][prev["doc"]])
+                starts.extend(cached_chunks["start"][old_start:old_end].tolist())
+                ends.extend(cached_chunks["end"][old_start:old_end].tolist())
+                refs.extend(cached_chunks["refs"][old_start:old_end])
+                reused.append((row, old_start, old_end - old_start))
+            else:
+                title = os.path.splitext(os.path.basename(fp))[0]
+                contents.append(_read_tex(fp))
+                for i, (ch_start, ch_end) in enumerate(_chunk(contents[-1])):
+                    starts.append(ch_start)
+                    ends.append(ch_end)
+                    refs.append(f"{title}, chunk {i + 1}")
+                stale.append((row, len(refs) - row))
+            doc.extend([len(contents) - 1] * (len(refs) - row))
+            self._file_meta[fp] = {
+                "stat": _file_stat(fp), "hash": digest, "doc": len(contents) - 1, "rows": (row, len(refs)),
+            }
 
-        if not self.entries:
+        if not refs:
             raise RuntimeError("[RAG] No text chunks were created. Check if .tex files are being copied correctly.")
 
-        print("[RAG] Total chunks created:", len(self.entries))
-        print("[RAG] First chunk preview:", self.entries[0].text[:400])
+        self._set_chunks({"contents": contents, "doc": doc, "start": starts, "end": ends, "refs": refs})
+        print("[RAG] Total chunks created:", len(self.refs))
+        print("[RAG] First chunk preview:", self._chunk_text(0, limit=400))
 
-        # Encode chunks
-        texts = [e.text for e in self.entries]
-        print("[RAG] Encoding chunks into embeddings...")
-        embs = self.model.encode(
+        # Encode only chunks from new or changed files
+        n_stale = sum(count for _, count in stale)
+        print(f"[RAG] Encoding {n_stale} chunks into embeddings ({len(self.refs) - n_stale} cached)...")
+        texts = [self._chunk_text(i) for new_start, count in stale for i in range(new_start, new_start + count)]
+        new_embs = self._encode(texts) if texts else None
+        if not reused:
+            # Cold build: the encoder output is already the full (N, d) matrix
+            embs = np.ascontiguousarray(new_embs, dtype=np.float32)
+        else:
+            # Incremental rebuild: merge cached and fresh rows, one slice per file
+            dim = new_embs.shape[1] if new_embs is not None else cached_embs.shape[1]
+            embs = np.empty((len(self.refs), dim), dtype=np.float32)
+            for new_start, old_start, count in reused:
+                embs[new_start:new_start + count] = cached_embs[old_start:old_start + count]
+            offset = 0
+            for new_start, count in stale:
+                embs[new_start:new_start + count] = new_embs[offset:offset + count]
+                offset += count
+        print("[RAG] Embeddings generated. Shape:", embs.shape)
+
+        # Build FAISS HNSW graph index (inner product == cosine on normalized embeddings)
+        self.index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        self.index.add(embs)  # already C-contiguous float32, so FAISS reads it without a copy
+        self._embs = embs
+        print("[RAG] FAISS index built successfully.")
+
+    def _set_chunks(self, chunks: Dict) -> None:
+        self.contents = chunks["contents"]
+        self.chunk_doc = np.asarray(chunks["doc"], dtype=np.int32)
+        self.chunk_start = np.asarray(chunks["start"], dtype=np.int64)
+        self.chunk_end = np.asarray(chunks["end"], dtype=np.int64)
+        self.refs = chunks["refs"]
+
+    def _chunk_text(self, i: int, limit: int = None) -> str:
+        """Materialize chunk i, or at most its first limit chars."""
+        start, end = int(self.chunk_start[i]), int(self.chunk_end[i])
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.contents[self.chunk_doc[i]][start:end]
+
+    def _encode(self, texts: List[str], show_progress_bar: bool = True) -> np.ndarray:
+        # Encoders tokenize once and batch in token-length order internally, so each
+        # mini-batch pads to a similar length; rows come back in input order
+        return self.model.encode(
             texts,
+            batch_size=64,
             convert_to_numpy=True,
             normalize_embeddings=True,
-            show_progress_bar=True
+            show_progress_bar=show_progress_bar
         )
-        print("[RAG] Embeddings generated. Shape:", embs.shape)
 
-        # Build FAISS index
-        dim = embs.shape[1]
-        self.index = faiss.IndexFlatIP(dim)
-        self.index.add(embs.astype("float32"))
-        self._embs = embs
-        print("[RAG] FAISS index built successfully.")
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _load_cache(self, cache_key: Dict):
+        """Return (manifest, mmapped embeddings) from a previous build, or (None, None)."""
+        paths = [self._cache_path(n) for n in ("chunks.pkl", "embs.npy", "kb.faiss")]
+        if not all(os.path.exists(p) for p in paths):
+            return None, None
+        try:
+            with open(paths[0], "rb") as f:
+                manifest = pickle.load(f)
+            embs = np.load(paths[1], mmap_mode="r")
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+            logger.warning(f"[RAG] Ignoring unreadable index cache in {self.cache_dir}: {e}")
+            return None, None
+        if manifest.get("key") != cache_key:
+            print("[RAG] Index cache was built with different settings; rebuilding.")
+            return None, None
+        return manifest, embs
+
+    def _save_cache(self, cache_key: Dict) -> None:
+        """Write index, embeddings and manifest; the manifest goes last so partial writes are ignored."""
+        manifest_path = self._cache_path("chunks.pkl")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            faiss.write_index(self.index, self._cache_path("kb.faiss"))
+            np.save(self._cache_path("embs.npy"), self._embs)
+            with open(manifest_path, "wb") as f:
+                chunks = {
+                    "contents": self.contents, "doc": self.chunk_doc, "start": self.chunk_start,
+                    "end": self.chunk_end, "refs": self.refs,
+                }
+                pickle.dump({"key": cache_key, "files": self._file_meta, "chunks": chunks}, f)
+        except (OSError, RuntimeError) as e:  # faiss raises RuntimeError when it cannot write
+            logger.warning(f"[RAG] Could not save index cache to {self.cache_dir}: {e}")
+            return
+        print("[RAG] Index cache saved to:", self.cache_dir)
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Return (len(queries), dim) embeddings, encoding all cache misses in one call."""
+        with self._qcache_lock:
+            cached = {q: self._qcache[q] for q in queries if q in self._qcache}
+            for q in cached:
+                self._qcache.move_to_end(q)
+
+        missing = [q for q in dict.fromkeys(queries) if q not in cached]
+        if missing:
+            fresh = np.asarray(self._encode(missing, show_progress_bar=False), dtype=np.float32)
+            with self._qcache_lock:
+                for q, v in zip(missing, fresh):
+                    cached[q] = self._qcache[q] = v
+                while len(self._qcache) > QUERY_CACHE_SIZE:
+                    self._qcache.popitem(last=False)
+
+        return np.stack([cached[q] for q in queries])
 
     def retrieve(self, query: str, top_k: int = 2) -> List[Dict]:
-        results = []
-        q_emb = self.model.encode(
-            [query],
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        ).astype("float32")
-        scores, idxs = self.index.search(q_emb, top_k)
-        for i in idxs[0]:
-            entry = self.entries[int(i)]
-            # Truncate long chunks
-            text = entry.text[:1000]
-            results.append({"text": text, "reference": entry.reference})
-        return results
+        return self.retrieve_batch([query], top_k=top_k)[0]
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 2) -> List[List[Dict]]:
+        """Retrieve top_k chunks for each query with a single FAISS search."""
+        if not queries:
+            return []
+        q_embs = self._embed_queries(queries)
+        # Index build uses every core; searches run one per request thread, so keep
+        # FAISS from spawning an OpenMP team per query and oversubscribing the CPU.
+        # OpenMP thread counts are per OS thread, so limit (and restore) it here in
+        # the searching thread; restoring keeps torch encodes on this thread unaffected.
+        omp_threads = faiss.omp_get_max_threads()
+        faiss.omp_set_num_threads(FAISS_SEARCH_THREADS)
+        try:
+            # efSearch goes in per-call params: concurrent calls with different top_k
+            # must not race on a field of the shared index
+            params = faiss.SearchParametersHNSW(efSearch=max(HNSW_EF_SEARCH, top_k * 8))
+            scores, idxs = self.index.search(q_embs, top_k, params=params)
+        finally:
+            faiss.omp_set_num_threads(omp_threads)
 
+        batch_results = []
+        for row in idxs:
+            results = []
+            for i in row:
+                if i < 0:  # HNSW pads with -1 when fewer than top_k neighbours are found
+                    continue
+                # Truncate long chunks
+                results.append({"text": self._chunk_text(i, limit=1000), "reference": self.refs[i]})
+            batch_results.append(results)
+        return batch_results
@@ -16,48 +16,77 @@ This script scans a .tex file (or multiple files) and extracts:
 Output: JSON (saved in `output/` folder)
 """
 
-import re
 import os
 import json
 import sys
+import mmap
+import re as std_re
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import re2 as re #google-re2: linear-time DFA matching, same API for the patterns below
+except ImportError:
+    import re
+
+# ---------- Compiled patterns ----------
+# Byte patterns: they scan the file bytes (memory-mapped under stdlib re), only matches get decoded
+
+def compile_bytes(pattern):
+    # RE2 defaults to UTF-8, where '.' skips invalid bytes; Latin-1 gives plain byte matching like stdlib re
+    if re.__name__ == "re2":
+        options = re.Options()
+        options.encoding = re.Options.Encoding.LATIN1
+        return re.compile(pattern, options)
+    return re.compile(pattern)
+
+TITLE_RE = compile_bytes(rb'(?s)\\title\{(.+?)\}') #Searches for \title{...}. (?s) (DOTALL) allows to match newlines, so the abstract can span multiple lines
+ABSTRACT_RE = compile_bytes(rb'(?s)\\begin\{abstract\}(.+?)\\end\{abstract\}')
+WHITESPACE_RE = std_re.compile(r'\s+') #Always stdlib re on decoded text: RE2's \s is ASCII-only, this keeps Unicode whitespace (e.g. NBSP) collapsing
+YEAR_RE = compile_bytes(rb'(19|20)\d{2}') #Could be easily wrong -> grabs the first instance of the year it sees
+CITATION_RE = compile_bytes(rb'\\cite[tp]?\{(.+?)\}') #Can either be citet or citep or cite (optional addition of t or p)
+EQUATION_ENV_RE = compile_bytes(rb'(?s)\\begin\{equation\}(.+?)\\end\{equation\}') #Find equations inside \begin{equation} ... \end(equation)
+DISPLAY_MATH_RE = compile_bytes(rb'(?s)\\\[(.+?)\\\]') #Find equations written as \[ ... \]
+TABLE_RE = compile_bytes(rb'(?s)\\begin\{table\}(.+?)\\end\{table\}')
+NON_BODY_RE = compile_bytes(rb'(?s)\\begin\{figure\}.*?\\end\{figure\}|\\begin\{table\}.*?\\end\{table\}|\\begin\{equation\}.*?\\end\{equation\}|\\\[.*?\\\]') #Figures, tables, display math and \[ \] equations in one alternation
 
 # ---------- Helper functions ----------
+# Each helper takes the raw file bytes (or an mmap of them) and returns decoded strings
+
+def decode(raw):
+    # Same result as reading the file in text mode: ignore bad UTF-8, normalize newlines
+    return raw.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
 
 def extract_title(text):
-    match = re.search(r'\\title\{(.+?)\}', text, re.DOTALL) #Searches for \title{...}. DOTALL allows to match newlines, so the abstract can span multiple lines
-    return match.group(1).strip() if match else "N/A"
+    match = TITLE_RE.search(text)
+    return decode(match.group(1)).strip() if match else "N/A"
 
 def extract_abstract(text):
-    match = re.search(r'\\begin\{abstract\}(.+?)\\end\{abstract\}', text, re.DOTALL)
-    return re.sub(r'\s+', ' ', match.group(1).strip()) if match else "N/A"
+    match = ABSTRACT_RE.search(text)
+    return WHITESPACE_RE.sub(' ', decode(match.group(1)).strip()) if match else "N/A"
 
 def extract_year(text):
     # Try common patterns like 20xx or 19xx
-    match = re.search(r'(19|20)\d{2}', text) #Could be easily wrong -> grabs the first instance of the year it sees
-    return match.group(0) if match else "N/A" #re.search stops at the first match
+    match = YEAR_RE.search(text)
+    return decode(match.group(0)) if match else "N/A" #re.search stops at the first match
 
 def extract_citations(text):
     # Capture all \cite{} and \citep{} style citations
-    citations = re.findall(r'\\cite[tp]?\{(.+?)\}', text) #Can either be citet or citep or cite (optional addition of t or p)
+    citations = [decode(c) for c in CITATION_RE.findall(text)]
     return list(set(citations)) if citations else [] #removes duplicates
 
 def extract_equations(text, max_equations=5):
     # Match equations inside equation environments or \[ \]
-    eqs = re.findall(r'\\begin\{equation\}(.+?)\\end\{equation\}', text, re.DOTALL) #Find equations inside \begin{equation} ... \end(equation)
-    eqs += re.findall(r'\\\[(.+?)\\\]', text, re.DOTALL) #Find equations written as \[ ... \]
-    return [e.strip() for e in eqs[:max_equations]] #remove extra whitespace and newlines around each equation string
+    eqs = EQUATION_ENV_RE.findall(text)
+    eqs += DISPLAY_MATH_RE.findall(text)
+    return [decode(e).strip() for e in eqs[:max_equations]] #remove extra whitespace and newlines around each equation string
 
 def extract_table(text):
-    match = re.search(r'\\begin\{table\}(.+?)\\end\{table\}', text, re.DOTALL) #Return the entire first table block
-    return match.group(0).strip() if match else "N/A" #Group 0 returns the entire match
+    match = TABLE_RE.search(text) #Return the entire first table block
+    return decode(match.group(0)).strip() if match else "N/A" #Group 0 returns the entire match
 
 def clean_main_text(text):
-    # Remove environments like figure, table, equation to get main body only
-    text = re.sub(r'\\begin\{figure\}.*?\\end\{figure\}', '', text, flags=re.DOTALL) #Remove figures
-    text = re.sub(r'\\begin\{table\}.*?\\end\{table\}', '', text, flags=re.DOTALL) #Removes tables
-    text = re.sub(r'\\begin\{equation\}.*?\\end\{equation\}', '', text, flags=re.DOTALL) #Remove display math
-    text = re.sub(r'\\\[.*?\\\]', '', text, flags=re.DOTALL) #Removes equations
-    return text
+    # Remove environments like figure, table, equation to get main body only (single pass)
+    return decode(NON_BODY_RE.sub(b'', text))
 
 def extract_main_text_sample(text, sample_len=500):
     clean_text = clean_main_text(text)
@@ -69,9 +98,15 @@ def extract_main_text_sample(text, sample_len=500):
 # ---------- Core parser ----------
 
 def process_tex_file(filepath):
-    with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
-        content = f.read() #Open a .tex file and read its content
-
+    with open(filepath, "rb") as f:
+        # mmap can't map an empty file, and google-re2's findall/sub rebuild results with type(text)(), which fails on mmap
+        if re.__name__ == "re2" or os.fstat(f.fileno()).st_size == 0:
+            return process_tex_content(f.read())
+        #Map the .tex file instead of reading it -> regexes scan the OS page cache directly
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return process_tex_content(content)
+
+def process_tex_content(content):
     # Go through each of the extraction functions and store its result in dictionary (data)
     data = {
         "title": extract_title(content),
@@ -99,18 +134,17 @@ def main():
         print("No .tex files found in 'input/' folder.")
         sys.exit(1)
 
-    # For each file -> first process
-    for filename in tex_files:
-        path = os.path.join(input_dir, filename)
-        print(f"Processing: {filename}")
-
-        result = process_tex_file(path)
-        out_path = os.path.join(output_dir, filename.replace(".tex", ".json"))
+    # Files are independent -> process them in parallel, one worker per core
+    paths = [os.path.join(input_dir, filename) for filename in tex_files]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for filename, result in zip(tex_files, executor.map(process_tex_file, paths)):
+            print(f"Processed: {filename}")
+            out_path = os.path.join(output_dir, filename.replace(".tex", ".json"))
 
-        with open(out_path, "w", encoding="utf-8") as out_f:
-            json.dump(result, out_f, indent=2, ensure_ascii=False)
+            with open(out_path, "w", encoding="utf-8") as out_f:
+                json.dump(result, out_f, indent=2, ensure_ascii=False)
 
-        print(f"Saved extracted features → {out_path}")
+            print(f"Saved extracted features → {out_path}")
 
 if __name__ == "__main__":
     main()